@@ -1,5 +1,6 @@
 from sentence_transformers import SentenceTransformer
 from openai import OpenAI
+import numpy as np
 import os
 
 import config_operator
@@ -68,6 +69,47 @@ def text_vectorization(text, normalize_embeddings = True):
 		basic_program.log_message(f"{e}", 40)
 		return None
 
+def cached_text_vectorization(texts, cache, normalize_embeddings = True):
+	"""
+	带缓存的文本向量化函数 BGE-large-zh
+
+	先按 (模型名称, 是否归一化, 文本哈希) 查询向量缓存，只把未命中的文本交给
+	text_vectorization 编码，编码结果写回缓存。
+
+	参数:
+		texts (list): 文本列表
+		cache (EmbeddingCache): 向量缓存，应由父进程创建并在整个任务中复用，
+			结束时由创建者调用 flush（或使用 with 语句）
+		normalize_embeddings (bool): 是否对向量进行归一化，默认为True
+
+	返回:
+		numpy.ndarray: 形状为(len(texts), embedding_dim)的文本向量；编码失败时返回None
+
+	示例:
+		>>> config_data = config_operator.get_config_data()
+		>>> with EmbeddingCache(config_data["embedding_cache_path"]) as cache:
+		...     vectors = cached_text_vectorization(["文本1", "文本2", "文本3"], cache)
+		>>> print(vectors.shape)  # (3, 1024)
+
+	注意:
+		- 缓存只允许一个进程写入，不要在 multiprocessing.Pool 的子进程中调用
+	"""
+	if not texts:
+		return None
+	model_name = "bge-large-zh-v1.5"
+	hits, misses = cache.get_many(texts, model_name, normalize_embeddings)
+	basic_program.log_message(f"向量缓存命中 {len(hits)} 条，未命中 {len(misses)} 条", printing = False)
+	if misses:
+		# 重复的文本只编码一次
+		miss_texts = list(dict.fromkeys(texts[i] for i in misses))
+		embeddings = text_vectorization(miss_texts, normalize_embeddings)
+		if embeddings is None:
+			return None
+		cache.put_many(miss_texts, embeddings, model_name, normalize_embeddings)
+		encoded = dict(zip(miss_texts, embeddings))
+		hits.update((i, encoded[texts[i]]) for i in misses)
+	return np.stack([hits[i] for i in range(len(texts))])
+
 def unified_explain(word, explain):
 	"""
 	AI词语含义格式化工具 模型代号 Initial_Thaw_DS
@@ -137,6 +137,7 @@ def _check_and_create_config():
 			"target_dict": "target.txt",
 			"start_index": 0,
 			"module_path": "./module/",
+			"embedding_cache_path": "./cache/",
 			"llm_api": {
 				"api_key": "none",
 				"base_url": "https://api.deepseek.com/v1",
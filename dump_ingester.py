@@ -0,0 +1,467 @@
+import bz2
+import collections
+import contextlib
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import urllib.parse
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+
+import basic_program
+from mariadb_operator import Db_operator
+
+# 核心关系集与各数据源属性的对应关系
+WIKIDATA_RELATIONS = {
+	"P31": "IsA",         # instance of
+	"P279": "IsA",        # subclass of
+	"P361": "PartOf",     # part of
+	"P131": "LocatedIn",  # located in the administrative territorial entity
+	"P276": "LocatedIn",  # location
+	"P1542": "Causes",    # has effect
+	"P460": "Synonym",    # said to be the same as
+	"P461": "Antonym",    # opposite of
+}
+DBPEDIA_RELATIONS = {
+	"http://www.w3.org/1999/02/22-rdf-syntax-ns#type": "IsA",
+	"http://www.w3.org/2004/02/skos/core#broader": "IsA",
+	"http://dbpedia.org/ontology/isPartOf": "PartOf",
+	"http://dbpedia.org/ontology/location": "LocatedIn",
+	"http://dbpedia.org/ontology/country": "LocatedIn",
+	"http://www.w3.org/2002/07/owl#sameAs": "Synonym",
+}
+CHINESE_LANGUAGES = ("zh", "zh-hans", "zh-cn")
+RDFS_LABEL = "http://www.w3.org/2000/01/rdf-schema#label"
+RDFS_COMMENT = "http://www.w3.org/2000/01/rdf-schema#comment"
+
+WIKIDATA_SOURCE = "www.wikidata.org"
+WIKIDATA_ENTITY_PREFIX = "http://www.wikidata.org/entity/"
+
+# 实体编号（如长标题的 DBpedia 资源名、本体IRI）可能超过可索引的长度，
+# 完整文本存为 TEXT，主键使用服务端计算的 UNHEX(MD5(编号))
+CREATE_ENTITY_TABLE = """
+	CREATE TABLE IF NOT EXISTS kb_entity (
+		source VARCHAR(32) NOT NULL,
+		entity_hash BINARY(16) NOT NULL,
+		entity_id TEXT NOT NULL,
+		词语 TEXT NOT NULL,
+		word_id INT NOT NULL,
+		PRIMARY KEY (source, entity_hash),
+		INDEX (word_id)
+	)"""
+CREATE_RELATION_TABLE = """
+	CREATE TABLE IF NOT EXISTS kb_relation (
+		source VARCHAR(32) NOT NULL,
+		head_hash BINARY(16) NOT NULL,
+		head_id TEXT NOT NULL,
+		relation VARCHAR(32) NOT NULL,
+		tail_source VARCHAR(32) NOT NULL,
+		tail_hash BINARY(16) NOT NULL,
+		tail_id TEXT NOT NULL,
+		PRIMARY KEY (source, head_hash, relation, tail_source, tail_hash)
+	)"""
+
+_DBPEDIA_RESOURCE_PATTERN = re.compile(r'^https?://([^/]*dbpedia\.org)/resource/(.+)$')
+_TRIPLE_PATTERN = re.compile(r'^<([^>]*)>\s+<([^>]*)>\s+(.+?)\s*\.\s*$')
+_LITERAL_PATTERN = re.compile(r'^"((?:[^"\\]|\\.)*)"(?:@([A-Za-z\-]+)|\^\^<[^>]*>)?$')
+_ESCAPE_PATTERN = re.compile(r'\\(U[0-9A-Fa-f]{8}|u[0-9A-Fa-f]{4}|.)')
+_SIMPLE_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+def _decompress_command(path, threads):
+	"""
+	返回外部解压命令，找不到可用工具时返回None
+
+	bz2 由相互独立的块组成，lbzip2 / pbzip2 可以对任意 bz2 文件多线程解压；
+	gzip 的解压本身是串行的，pigz 把读取、校验和输出放到额外线程中，至少把解压移出了父进程。
+	"""
+	if path.endswith(".bz2"):
+		if shutil.which("lbzip2"):
+			return ["lbzip2", "-dc", "-n", str(threads), path]
+		if shutil.which("pbzip2"):
+			return ["pbzip2", "-dc", f"-p{threads}", path]
+	elif path.endswith(".gz"):
+		if shutil.which("pigz"):
+			return ["pigz", "-dc", "-p", str(threads), path]
+	return None
+
+
+@contextlib.contextmanager
+def _open_dump(path, threads = 1):
+	"""按扩展名以二进制流的方式打开（压缩的）转储文件，优先使用外部并行解压工具"""
+	command = _decompress_command(path, threads)
+	if command:
+		basic_program.log_message(f"使用 {command[0]} 解压 {path}")
+		process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=1 << 20)
+		try:
+			yield process.stdout
+		finally:
+			process.stdout.close()
+			return_code = process.wait()
+			if return_code not in (0, -13):  # -13: 提前停止读取时的 SIGPIPE
+				basic_program.log_message(f"{command[0]} 异常退出，返回码 {return_code}", 40)
+		return
+	if path.endswith(".bz2"):
+		basic_program.log_message("未找到 lbzip2 / pbzip2，使用单线程 bz2 解压", 30)
+		file = bz2.open(path, 'rb')
+	elif path.endswith(".gz"):
+		basic_program.log_message("未找到 pigz，使用 gzip 模块解压", 30)
+		file = gzip.open(path, 'rb')
+	else:
+		file = open(path, 'rb')
+	with file:
+		yield file
+
+
+def _detect_format(path):
+	"""根据文件名判断转储格式：wikidata（JSON行）或 ntriples"""
+	name = path
+	for suffix in (".bz2", ".gz"):
+		if name.endswith(suffix):
+			name = name[:-len(suffix)]
+	if name.endswith(".nt") or name.endswith(".ttl"):
+		return "ntriples"
+	if name.endswith(".json") or name.endswith(".jsonl"):
+		return "wikidata"
+	raise ValueError(f"无法识别的转储格式: {path}")
+
+
+def _unescape(text):
+	"""还原 N-Triples 字面量中的转义字符"""
+	def replace(match):
+		escape = match.group(1)
+		if escape[0] in "uU" and len(escape) > 1:
+			return chr(int(escape[1:], 16))
+		return _SIMPLE_ESCAPES.get(escape, escape)
+	return _ESCAPE_PATTERN.sub(replace, text)
+
+
+def _iri_to_entity(iri):
+	"""
+	把IRI转换为 (source, entity_id)
+
+	DBpedia 资源保留 /resource/ 之后的完整名称（如 AC/DC）并还原百分号编码，
+	Wikidata 实体转换为 Q 编号，其他IRI（本体类等）原样保留，来源记为 "iri"。
+	"""
+	if iri.startswith(WIKIDATA_ENTITY_PREFIX):
+		return WIKIDATA_SOURCE, iri[len(WIKIDATA_ENTITY_PREFIX):]
+	match = _DBPEDIA_RESOURCE_PATTERN.match(iri)
+	if match:
+		return match.group(1), urllib.parse.unquote(match.group(2))
+	return "iri", iri
+
+
+def _build_xml(source, explain):
+	"""生成与 chn_wordlist 中 XML含义 相同结构的初始XML"""
+	root = ET.Element('word_definition')
+	traditional_meaning = ET.SubElement(root, 'traditional_meaning')
+	if explain:
+		word_meaning = ET.SubElement(traditional_meaning, 'word_meaning')
+		source_elem = ET.SubElement(word_meaning, 'source')
+		source_elem.text = source
+		data_elem = ET.SubElement(word_meaning, 'data')
+		data_elem.text = explain
+	ET.SubElement(root, 'model_meaning')
+	rough_string = ET.tostring(root, encoding='utf-8')
+	reparsed = minidom.parseString(rough_string)
+	return reparsed.toprettyxml(indent=" ", encoding="utf-8").decode('utf-8')
+
+
+def _pick_chinese(values):
+	"""从 {语言: {"value": ...}} 中按优先级取中文文本"""
+	for language in CHINESE_LANGUAGES:
+		if language in values:
+			return values[language]["value"]
+	return None
+
+
+def parse_wikidata_chunk(data):
+	"""
+	解析一批 Wikidata JSON 转储行
+
+	在子进程中完成解码、过滤和XML生成，父进程只负责切块和写库。
+
+	参数:
+		data (bytes): 转储文件中连续的若干完整行，每行为一个实体（可能带有结尾逗号）
+
+	返回:
+		tuple: (entities, comments, edges)
+			- entities (list): (source, entity_id, 中文标签, 新词语的初始XML含义)
+			- comments (list): (source, entity_id, 带描述的XML含义)
+			- edges (list): (source, head_id, relation, tail_source, tail_id)
+
+	描述与 DBpedia 一样以 comments 的形式返回，写库时补充到还没有释义的词语上，
+	因此词语已存在或同名实体在同一批中出现时，描述不会被丢弃。
+	"""
+	entities = []
+	comments = []
+	edges = []
+	# JSON 字符串中可能含有 U+2028 等字符，只按 \n 分行
+	for line in data.decode('utf-8').split('\n'):
+		line = line.strip().rstrip(',')
+		if not line or line in ("[", "]"):
+			continue
+		try:
+			entity = json.loads(line)
+		except json.JSONDecodeError:
+			continue
+		label = _pick_chinese(entity.get("labels", {}))
+		if label is None:
+			continue
+		entity_id = entity["id"]
+		entities.append((WIKIDATA_SOURCE, entity_id, label, _build_xml(WIKIDATA_SOURCE, None)))
+		explain = _pick_chinese(entity.get("descriptions", {}))
+		if explain:
+			comments.append((WIKIDATA_SOURCE, entity_id, _build_xml(WIKIDATA_SOURCE, explain)))
+		claims = entity.get("claims", {})
+		for prop, relation in WIKIDATA_RELATIONS.items():
+			for claim in claims.get(prop, ()):
+				value = claim.get("mainsnak", {}).get("datavalue", {}).get("value")
+				if isinstance(value, dict) and "id" in value:
+					edges.append((WIKIDATA_SOURCE, entity_id, relation, WIKIDATA_SOURCE, value["id"]))
+	return entities, comments, edges
+
+
+def parse_ntriples_chunk(data):
+	"""
+	解析一批 DBpedia N-Triples 转储行
+
+	返回格式与 parse_wikidata_chunk 相同。标签与描述分布在不同的三元组（通常是不同文件）中，
+	描述同样以 comments 的形式返回，写库时按 kb_entity 中记录的 word_id 补充到词语上。
+	"""
+	entities = []
+	comments = []
+	edges = []
+	for line in data.decode('utf-8').split('\n'):
+		match = _TRIPLE_PATTERN.match(line)
+		if not match:
+			continue
+		subject, predicate, obj = match.groups()
+		source, entity_id = _iri_to_entity(subject)
+		if predicate in (RDFS_LABEL, RDFS_COMMENT):
+			literal = _LITERAL_PATTERN.match(obj)
+			if not literal or (literal.group(2) or "").lower() not in CHINESE_LANGUAGES:
+				continue
+			text = _unescape(literal.group(1))
+			if predicate == RDFS_LABEL:
+				entities.append((source, entity_id, text, _build_xml(source, None)))
+			else:
+				comments.append((source, entity_id, _build_xml(source, text)))
+		elif predicate in DBPEDIA_RELATIONS and obj.startswith('<'):
+			tail_source, tail_id = _iri_to_entity(obj[1:-1])
+			edges.append((source, entity_id, DBPEDIA_RELATIONS[predicate], tail_source, tail_id))
+	return entities, comments, edges
+
+
+_PARSERS = {
+	"wikidata": parse_wikidata_chunk,
+	"ntriples": parse_ntriples_chunk,
+}
+
+
+def _read_chunks(path, chunk_bytes, threads):
+	"""
+	流式读取转储文件，每次产出约 chunk_bytes 字节、以完整行结尾的 bytes
+
+	父进程不解码也不分行，传给子进程的是单个 bytes 对象，序列化开销很小。
+	"""
+	with _open_dump(path, threads) as file:
+		while True:
+			block = file.read(chunk_bytes)
+			if not block:
+				return
+			yield block + file.readline()
+
+
+class _BatchWriter(object):
+	"""
+	缓存解析结果并分批写入数据库
+
+	词语按文本查重后再插入 chn_wordlist，不依赖 词语 列上的唯一键；
+	实体在 kb_entity 中记录对应的 chn_wordlist.id。两个数据源的描述都按该 id
+	补充到还没有任何释义的词语上，已有释义的词语不会被覆盖。
+	"""
+	def __init__(self, batch_size):
+		self.batch_size = batch_size
+		self.entities = []
+		self.comments = []
+		self.edges = []
+		self.mariadb = Db_operator()
+		self.total_entities = 0
+		self.total_comments = 0
+		self.total_edges = 0
+
+	def add(self, entities, comments, edges):
+		self.entities.extend(entities)
+		self.comments.extend(comments)
+		self.edges.extend(edges)
+		if max(len(self.entities), len(self.comments), len(self.edges)) >= self.batch_size:
+			self.flush()
+
+	def _word_ids(self, labels):
+		"""查询已存在词语的 id，同一词语有多行时取最小的 id"""
+		if not labels:
+			return {}
+		placeholders = ", ".join("?" * len(labels))
+		result = self.mariadb.safe_db_operation(
+			f"SELECT 词语, MIN(id) FROM chn_wordlist WHERE 词语 IN ({placeholders}) GROUP BY 词语",
+			params=tuple(labels),
+			fetch=True
+		)
+		return dict(result or [])
+
+	def _entity_word_ids(self, keys):
+		"""查询 (source, entity_id) 对应的 word_id"""
+		found = {}
+		by_source = collections.defaultdict(list)
+		for source, entity_id in keys:
+			by_source[source].append(entity_id)
+		for source, entity_ids in by_source.items():
+			placeholders = ", ".join(["UNHEX(MD5(?))"] * len(entity_ids))
+			result = self.mariadb.safe_db_operation(
+				f"SELECT entity_id, word_id FROM kb_entity WHERE source = ? AND entity_hash IN ({placeholders})",
+				params=(source, *entity_ids),
+				fetch=True
+			)
+			for entity_id, word_id in result or []:
+				found[(source, entity_id)] = word_id
+		return found
+
+	def _count(self, affected, table):
+		if affected is None:
+			basic_program.log_message(f"{table} 批量写入失败，本批数据未计入", 40)
+			return 0
+		return affected
+
+	def flush(self):
+		if self.entities:
+			# 先查重，只插入 chn_wordlist 中还没有的词语（批内同名只插入一次）
+			word_ids = self._word_ids(list(dict.fromkeys(label for _, _, label, _ in self.entities)))
+			new_words = {}
+			for _, _, label, xml in self.entities:
+				if label not in word_ids and label not in new_words:
+					new_words[label] = xml
+			if new_words:
+				self._count(self.mariadb.safe_db_batch_operation(
+					"INSERT INTO chn_wordlist (词语, XML含义) VALUES (?, ?)",
+					list(new_words.items())
+				), "chn_wordlist")
+				word_ids.update(self._word_ids(list(new_words)))
+			rows = [(source, entity_id, entity_id, label, word_ids[label])
+				for source, entity_id, label, _ in self.entities if label in word_ids]
+			self.total_entities += self._count(self.mariadb.safe_db_batch_operation(
+				"INSERT IGNORE INTO kb_entity (source, entity_hash, entity_id, 词语, word_id) "
+				"VALUES (?, UNHEX(MD5(?)), ?, ?, ?)",
+				rows
+			), "kb_entity")
+
+		if self.comments:
+			# 描述只补充到还没有任何释义的词语上
+			word_ids = self._entity_word_ids(list(dict.fromkeys((source, entity_id) for source, entity_id, _ in self.comments)))
+			rows = [(xml, word_ids[(source, entity_id)])
+				for source, entity_id, xml in self.comments if (source, entity_id) in word_ids]
+			if len(rows) < len(self.comments):
+				basic_program.log_message(f"{len(self.comments) - len(rows)} 条描述找不到对应实体，请先导入标签文件", 30, printing = False)
+			self.total_comments += self._count(self.mariadb.safe_db_batch_operation(
+				"UPDATE chn_wordlist SET XML含义 = ? WHERE id = ? AND XML含义 NOT LIKE '%<word_meaning>%'",
+				rows
+			), "chn_wordlist")
+
+		self.total_edges += self._count(self.mariadb.safe_db_batch_operation(
+			"INSERT IGNORE INTO kb_relation (source, head_hash, head_id, relation, tail_source, tail_hash, tail_id) "
+			"VALUES (?, UNHEX(MD5(?)), ?, ?, ?, UNHEX(MD5(?)), ?)",
+			[(source, head_id, head_id, relation, tail_source, tail_id, tail_id)
+				for source, head_id, relation, tail_source, tail_id in self.edges]
+		), "kb_relation")
+		self.entities = []
+		self.comments = []
+		self.edges = []
+
+
+def _ensure_word_index(mariadb):
+	"""
+	确保 chn_wordlist.词语 上有索引
+
+	每批写入前都要按 词语 查重，没有索引时每批都是全表扫描，导入整体会变成平方级。
+	TEXT 类型或超过191个字符的列只能建立前缀索引。
+	"""
+	indexes = mariadb.safe_db_operation(
+		"SELECT COUNT(*) FROM information_schema.STATISTICS "
+		"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'chn_wordlist' AND COLUMN_NAME = '词语' AND SEQ_IN_INDEX = 1",
+		fetch=True
+	)
+	if indexes and indexes[0][0]:
+		return
+	column = mariadb.safe_db_operation(
+		"SELECT DATA_TYPE, CHARACTER_MAXIMUM_LENGTH FROM information_schema.COLUMNS "
+		"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'chn_wordlist' AND COLUMN_NAME = '词语'",
+		fetch=True
+	)
+	if not column:
+		basic_program.log_message("无法读取 chn_wordlist.词语 的列信息，未建立索引", 30)
+		return
+	data_type, length = column[0]
+	prefix = "(191)" if data_type.lower().endswith("text") or (length or 0) > 191 else ""
+	basic_program.log_message("chn_wordlist.词语 没有索引，正在建立")
+	mariadb.safe_db_operation(f"CREATE INDEX idx_chn_wordlist_word ON chn_wordlist (词语{prefix})")
+
+
+def ingest_dump(path, processes = None, chunk_bytes = 4 << 20, batch_size = 5000):
+	"""
+	流式导入 Wikidata / DBpedia 本地转储文件
+
+	解压交给外部的 lbzip2 / pbzip2（bz2，多线程）或 pigz（gz）进程，找不到时退回 Python 内置模块；
+	父进程只把解压后的数据切成以完整行结尾的字节块，子进程并行解码、解析 JSON / N-Triples、
+	过滤出中文标签与核心关系并生成XML，父进程把结果分批写入 chn_wordlist、kb_entity 和 kb_relation。
+	同时在途的块数量有上限，因此内存占用与转储文件大小无关。
+	DBpedia 的标签与摘要分属不同文件，应先导入标签文件再导入摘要文件。
+
+	参数:
+		path (str): 转储文件路径，支持 .json/.jsonl/.nt/.ttl（逐行三元组）以及对应的 .bz2/.gz 压缩文件
+		processes (int): 解析进程数，默认为CPU核心数
+		chunk_bytes (int): 每个解析任务的字节数（按完整行对齐）
+		batch_size (int): 每次批量写入数据库的行数
+
+	返回:
+		tuple: (新写入的实体数, 新写入的关系数)
+
+	示例:
+		>>> ingest_dump("latest-all.json.bz2")
+		>>> ingest_dump("labels_lang=zh.ttl.bz2")
+		>>> ingest_dump("short-abstracts_lang=zh.ttl.bz2")
+	"""
+	dump_format = _detect_format(path)
+	parser = _PARSERS[dump_format]
+	processes = processes or os.cpu_count() or 1
+	max_pending = processes * 2
+
+	mariadb = Db_operator()
+	mariadb.safe_db_operation(CREATE_ENTITY_TABLE)
+	mariadb.safe_db_operation(CREATE_RELATION_TABLE)
+	_ensure_word_index(mariadb)
+
+	writer = _BatchWriter(batch_size)
+	basic_program.log_message(f"开始导入 {path}，格式 {dump_format}，进程数 {processes}")
+	with multiprocessing.Pool(processes) as pool:
+		# Pool.imap 会一次性读完输入，这里自行限制在途任务数以保持内存恒定
+		pending = collections.deque()
+		for chunk in _read_chunks(path, chunk_bytes, processes):
+			pending.append(pool.apply_async(parser, (chunk,)))
+			if len(pending) >= max_pending:
+				writer.add(*pending.popleft().get())
+		while pending:
+			writer.add(*pending.popleft().get())
+	writer.flush()
+	basic_program.log_message(f"{path} 导入完成：实体 {writer.total_entities} 条，描述 {writer.total_comments} 条，关系 {writer.total_edges} 条")
+	return writer.total_entities, writer.total_edges
+
+
+if __name__ == "__main__":
+	basic_program.boot()
+	for dump_path in sys.argv[1:]:
+		ingest_dump(dump_path)
@@ -0,0 +1,414 @@
+import functools
+import math
+import os
+import sys
+import tempfile
+import zlib
+
+import numpy as np
+
+import basic_program
+import xml_operator
+from mariadb_operator import Db_operator
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+CREATE_CANDIDATE_TABLE = """
+	CREATE TABLE IF NOT EXISTS similar_candidate (
+		id_a INT NOT NULL,
+		id_b INT NOT NULL,
+		method VARCHAR(16) NOT NULL,
+		similarity FLOAT NOT NULL,
+		PRIMARY KEY (id_a, id_b, method),
+		INDEX (method, similarity)
+	)"""
+
+
+def _bands_for_recall(hit, min_recall):
+	"""单段命中概率为 hit 时，使至少一段命中的概率不低于 min_recall 的最小分段数"""
+	if hit >= 1:
+		return 1
+	return max(1, math.ceil(math.log1p(-min_recall) / math.log1p(-hit)))
+
+
+def choose_minhash_bands(threshold, num_perm, min_recall = 0.95):
+	"""
+	为 MinHash LSH 选择分段数和每段行数
+
+	Jaccard 相似度为 threshold 的一对文本，单个 MinHash 值相同的概率就是 threshold。
+	在 b × r 不超过 num_perm 的组合中取最大的每段行数 r，使低相似度的词条对很少成为候选；
+	分段数 b 取使阈值处候选概率 1 - (1 - threshold^r)^b 不低于 min_recall 的最小值。
+	num_perm 不够时 r 取1，b × r 会超过 num_perm，由调用方加长签名。
+
+	返回:
+		tuple: (bands, rows_per_band)
+	"""
+	best = (_bands_for_recall(threshold, min_recall), 1)
+	for rows in range(2, num_perm + 1):
+		bands = _bands_for_recall(threshold ** rows, min_recall)
+		# r 增大时所需的 b × r 单调增加，超出后不必继续
+		if bands * rows > num_perm:
+			break
+		best = (bands, rows)
+	return best
+
+
+def collision_probability(probability, bands, rows_per_band):
+	"""单个哈希位相同的概率为 probability 时，至少在一个分段中落入同一个桶的概率"""
+	return 1 - (1 - probability ** rows_per_band) ** bands
+
+
+def choose_hyperplane_bands(threshold, count, min_recall = 0.95):
+	"""
+	为随机超平面LSH选择分段数和每段位数
+
+	余弦相似度为 threshold 的一对向量，单个超平面位相同的概率为 p = 1 - arccos(threshold) / π。
+	每段位数取不小于 log2(count) 的8的倍数，使随机向量很少落入同一个桶；
+	分段数取使阈值处候选概率 1 - (1 - p^r)^b 不低于 min_recall 的最小值。
+
+	返回:
+		tuple: (bands, rows_per_band)
+	"""
+	probability = 1 - math.acos(min(max(threshold, -1.0), 1.0)) / math.pi
+	rows = max(8, math.ceil(math.log2(max(count, 2)) / 8) * 8)
+	return _bands_for_recall(probability ** rows, min_recall), rows
+
+
+def _band_pairs(keys, max_bucket):
+	"""
+	按分段哈希值分桶，返回同桶内的所有下标对
+
+	完全重复的词条已由 _exact_duplicates 合并为一个代表，仍超过 max_bucket 的桶
+	直接跳过以避免平方级膨胀。
+	"""
+	order = np.argsort(keys, kind='stable')
+	sorted_keys = keys[order]
+	boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+	starts = np.concatenate(([0], boundaries))
+	ends = np.concatenate((boundaries, [len(keys)]))
+	firsts, seconds = [], []
+	skipped = 0
+	for start, end in zip(starts, ends):
+		size = end - start
+		if size < 2:
+			continue
+		if size > max_bucket:
+			skipped += 1
+			continue
+		members = order[start:end]
+		i, j = np.triu_indices(size, k=1)
+		firsts.append(members[i])
+		seconds.append(members[j])
+	if skipped:
+		basic_program.log_message(f"跳过了 {skipped} 个超过 {max_bucket} 条的LSH桶", 30, printing = False)
+	if not firsts:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	return np.concatenate(firsts), np.concatenate(seconds)
+
+
+class _CandidateWriter(object):
+	"""把通过验证的候选对分批写入 similar_candidate 表"""
+	def __init__(self, method, batch_size):
+		self.method = method
+		self.batch_size = batch_size
+		self.rows = []
+		self.total = 0
+		self.mariadb = Db_operator()
+		self.mariadb.safe_db_operation(CREATE_CANDIDATE_TABLE)
+
+	def add(self, ids_a, ids_b, similarities):
+		low = np.minimum(ids_a, ids_b)
+		high = np.maximum(ids_a, ids_b)
+		self.rows.extend(zip(low.tolist(), high.tolist(), [self.method] * len(low), similarities.tolist()))
+		if len(self.rows) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		# 同一对可能在多个分段中命中，批内先去重，跨批依靠主键去重
+		affected = self.mariadb.safe_db_batch_operation(
+			"INSERT IGNORE INTO similar_candidate (id_a, id_b, method, similarity) VALUES (?, ?, ?, ?)",
+			list(dict.fromkeys(self.rows))
+		)
+		self.total += affected or 0
+		self.rows = []
+
+
+def _row_keys(array, count, chunk_size):
+	"""把每行的完整签名折叠为一个64位键，按块读取以限制内存"""
+	keys = np.zeros(count, dtype=np.uint64)
+	for start in range(0, count, chunk_size):
+		block = np.asarray(array[start:start + chunk_size], dtype=np.uint64)
+		block_keys = np.zeros(len(block), dtype=np.uint64)
+		for column in range(block.shape[1]):
+			block_keys = block_keys * np.uint64(1000003) ^ block[:, column]
+		keys[start:start + len(block)] = block_keys
+	return keys
+
+
+def _exact_duplicates(full_keys, similarity_of, ids, threshold, writer, pair_batch):
+	"""
+	按完整签名分组，把签名完全相同的词条直接与组内第一条连成候选对
+
+	大组（如模板化释义）不会被分段分桶时的 max_bucket 丢掉，而且每组只产生 组大小-1 对。
+	组内第一条作为代表参与后续的分段分桶，其余词条不再参与。
+
+	返回:
+		tuple: (representatives, grouped)
+			- representatives (numpy.ndarray): 参与分段分桶的行下标（升序）
+			- grouped (int): 作为完全重复写入的候选对数量
+	"""
+	order = np.argsort(full_keys, kind='stable')
+	sorted_keys = full_keys[order]
+	is_first = np.ones(len(order), dtype=bool)
+	is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+	group_start = np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))
+	heads = order[group_start[~is_first]]
+	members = order[~is_first]
+	representatives = [order[is_first]]
+	grouped = 0
+	for start in range(0, len(members), pair_batch):
+		a = heads[start:start + pair_batch]
+		b = members[start:start + pair_batch]
+		similarities = similarity_of(a, b)
+		keep = similarities >= threshold
+		if keep.any():
+			writer.add(ids[a[keep]], ids[b[keep]], similarities[keep])
+			grouped += int(keep.sum())
+		# 折叠键碰撞或相似度未达阈值的词条仍按普通词条参与分桶
+		representatives.append(b[~keep])
+	return np.sort(np.concatenate(representatives)), grouped
+
+
+def _verify_bands(keys_of_band, bands, full_keys, similarity_of, ids, threshold, writer, max_bucket, pair_batch):
+	"""先合并完全重复的词条，再逐个分段分桶、验证候选对并写库，内存只与单个分段的桶有关"""
+	representatives, grouped = _exact_duplicates(full_keys, similarity_of, ids, threshold, writer, pair_batch)
+	if grouped:
+		basic_program.log_message(f"签名完全相同的词条对 {grouped} 条", printing = False)
+	for band in range(bands):
+		firsts, seconds = _band_pairs(keys_of_band(band)[representatives], max_bucket)
+		for start in range(0, len(firsts), pair_batch):
+			a = representatives[firsts[start:start + pair_batch]]
+			b = representatives[seconds[start:start + pair_batch]]
+			similarities = similarity_of(a, b)
+			keep = similarities >= threshold
+			if keep.any():
+				writer.add(ids[a[keep]], ids[b[keep]], similarities[keep])
+	writer.flush()
+
+
+def _shingle_hashes(text, shingle_size):
+	"""字符 n-gram 的哈希集合"""
+	if len(text) < shingle_size:
+		shingles = {text}
+	else:
+		shingles = {text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)}
+	return np.array([zlib.crc32(item.encode('utf-8')) for item in shingles], dtype=np.uint64) % _MERSENNE_PRIME
+
+
+@functools.lru_cache(maxsize=None)
+def _minhash_coefficients(num_perm, seed):
+	"""MinHash 使用的 (a*x + b) mod p 系数"""
+	rng = np.random.default_rng(seed)
+	a = rng.integers(1, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+	b = rng.integers(0, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+	return a, b
+
+
+def minhash_signature(text, num_perm = 128, shingle_size = 2, seed = 1):
+	"""
+	计算文本的 MinHash 签名
+
+	参数:
+		text (str): 文本
+		num_perm (int): 哈希函数个数
+		shingle_size (int): 字符 n-gram 的长度，中文释义默认使用2
+		seed (int): 随机种子，同一批数据必须使用相同的种子
+
+	返回:
+		numpy.ndarray: 形状为(num_perm,)的uint32签名
+	"""
+	a, b = _minhash_coefficients(num_perm, seed)
+	hashes = _shingle_hashes(text, shingle_size)
+	return ((a * hashes[None, :] + b) % _MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+def _read_definitions(chunk_size):
+	"""按 id 分页读取 chn_wordlist，逐块产出 (id, zgbk释义) 列表"""
+	mariadb = Db_operator()
+	last_id = 0
+	while True:
+		rows = mariadb.safe_db_operation(
+			"SELECT id, XML含义 FROM chn_wordlist WHERE id > ? ORDER BY id LIMIT ?",
+			params=(last_id, chunk_size),
+			fetch=True
+		)
+		if not rows:
+			return
+		last_id = rows[-1][0]
+		chunk = []
+		for id_num, xml in rows:
+			try:
+				text = xml_operator.test_operation_002_0(xml) if xml else None
+			except Exception as e:
+				basic_program.log_message(f"id 为 {id_num} 的条目XML解析失败\n    {e}", 30, printing = False)
+				continue
+			if text:
+				chunk.append((id_num, text))
+		yield chunk
+
+
+def detect_definition_duplicates(threshold = 0.8, num_perm = 128, min_recall = 0.95, shingle_size = 2,
+		chunk_size = 10000, max_bucket = 200, pair_batch = 100000, work_dir = None):
+	"""
+	用 MinHash LSH 找出 zgbk 释义几乎相同的词条对
+
+	签名按块计算并写入磁盘上的 memmap。完整签名相同的词条先直接与组内第一条配对，
+	之后逐个分段分桶，只对同桶词条估计 Jaccard 相似度，达到阈值的词条对写入
+	similar_candidate 表（method = "minhash"）。
+
+	参数:
+		threshold (float): Jaccard 相似度阈值
+		num_perm (int): MinHash 签名长度，不足以达到 min_recall 时自动加长
+		min_recall (float): 相似度恰好等于阈值的词条对成为候选对的最低概率
+		shingle_size (int): 字符 n-gram 的长度
+		chunk_size (int): 每次从数据库读取的行数
+		max_bucket (int): 单个LSH桶的最大词条数（签名完全相同的词条只计一次），超过则跳过
+		pair_batch (int): 每次验证的候选对数量
+		work_dir (str): 存放签名 memmap 的目录，默认为系统临时目录
+
+	返回:
+		int: 写入的候选对数量
+	"""
+	mariadb = Db_operator()
+	total = mariadb.safe_db_operation("SELECT COUNT(*) FROM chn_wordlist", fetch=True)[0][0]
+	bands, rows = choose_minhash_bands(threshold, num_perm, min_recall)
+	# 分段只使用签名的前 bands × rows 个值，验证相似度时使用完整签名
+	num_perm = max(num_perm, bands * rows)
+	basic_program.log_message(
+		f"MinHash LSH：{total} 条，签名长度 {num_perm}，{bands} 段 × {rows} 行，"
+		f"阈值处候选概率 {collision_probability(threshold, bands, rows):.3f}"
+	)
+
+	with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+		signatures = np.lib.format.open_memmap(
+			os.path.join(temp_dir, "minhash.npy"), mode='w+', dtype=np.uint32, shape=(max(total, 1), num_perm)
+		)
+		ids = np.zeros(max(total, 1), dtype=np.int64)
+		count = 0
+		for chunk in _read_definitions(chunk_size):
+			for id_num, text in chunk:
+				if count >= total:
+					break
+				signatures[count] = minhash_signature(text, num_perm, shingle_size)
+				ids[count] = id_num
+				count += 1
+		signatures.flush()
+		signatures = signatures[:count]
+		ids = ids[:count]
+
+		def keys_of_band(band):
+			band_rows = np.asarray(signatures[:, band * rows:(band + 1) * rows], dtype=np.uint64)
+			keys = np.zeros(count, dtype=np.uint64)
+			for column in range(rows):
+				keys = keys * np.uint64(1000003) ^ band_rows[:, column]
+			return keys
+
+		def similarity_of(a, b):
+			return (signatures[a] == signatures[b]).mean(axis=1)
+
+		writer = _CandidateWriter("minhash", pair_batch)
+		full_keys = _row_keys(signatures, count, chunk_size)
+		_verify_bands(keys_of_band, bands, full_keys, similarity_of, ids, threshold, writer, max_bucket, pair_batch)
+		del signatures
+
+	basic_program.log_message(f"MinHash LSH 完成，写入候选对 {writer.total} 条")
+	return writer.total
+
+
+def detect_embedding_duplicates(ids, matrix, threshold = 0.9, min_recall = 0.95, bands = None, rows_per_band = None,
+		chunk_size = 10000, max_bucket = 200, pair_batch = 100000, work_dir = None, seed = 1):
+	"""
+	用随机超平面 LSH 找出向量几乎相同的词条对
+
+	每个向量按随机超平面的正负号得到 bands × rows_per_band 位的签名，按块计算后以位压缩形式
+	写入 memmap；同一分段签名相同的词条对再用余弦相似度验证，达到阈值的写入
+	similar_candidate 表（method = "hyperplane"）。
+
+	参数:
+		ids (numpy.ndarray): chn_wordlist 中的 id，与 matrix 的行一一对应
+		matrix (numpy.ndarray): 词向量矩阵，可以是 np.load(..., mmap_mode='r') 得到的只读映射
+		threshold (float): 余弦相似度阈值（要求向量已归一化）
+		min_recall (float): 相似度恰好等于阈值的词条对成为候选对的最低概率
+		bands (int): 分段数，为None时由 choose_hyperplane_bands 按阈值计算
+		rows_per_band (int): 每段的位数，必须是8的倍数，为None时由 choose_hyperplane_bands 按阈值计算
+		chunk_size (int): 每次计算签名的行数
+		max_bucket (int): 单个LSH桶的最大词条数（签名完全相同的词条只计一次），超过则跳过
+		pair_batch (int): 每次验证的候选对数量
+		work_dir (str): 存放签名 memmap 的目录，默认为系统临时目录
+		seed (int): 随机种子
+
+	返回:
+		int: 写入的候选对数量
+	"""
+	ids = np.asarray(ids, dtype=np.int64)
+	count, dimension = matrix.shape
+	if bands is None or rows_per_band is None:
+		auto_bands, auto_rows = choose_hyperplane_bands(threshold, count, min_recall)
+		bands = bands or auto_bands
+		rows_per_band = rows_per_band or auto_rows
+	if rows_per_band % 8:
+		raise ValueError("rows_per_band 必须是8的倍数")
+	bytes_per_band = rows_per_band // 8
+	hyperplanes = np.random.default_rng(seed).standard_normal((dimension, bands * rows_per_band)).astype(np.float32)
+	probability = 1 - math.acos(min(max(threshold, -1.0), 1.0)) / math.pi
+	basic_program.log_message(
+		f"超平面 LSH：{count} 条，{bands} 段 × {rows_per_band} 位，"
+		f"阈值处候选概率 {collision_probability(probability, bands, rows_per_band):.3f}"
+	)
+
+	with tempfile.TemporaryDirectory(dir=work_dir) as temp_dir:
+		packed = np.lib.format.open_memmap(
+			os.path.join(temp_dir, "hyperplane.npy"), mode='w+', dtype=np.uint8,
+			shape=(max(count, 1), bands * bytes_per_band)
+		)
+		for start in range(0, count, chunk_size):
+			block = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+			packed[start:start + len(block)] = np.packbits(block @ hyperplanes > 0, axis=1)
+		packed.flush()
+
+		def keys_of_band(band):
+			band_bytes = np.asarray(packed[:count, band * bytes_per_band:(band + 1) * bytes_per_band], dtype=np.uint64)
+			keys = np.zeros(count, dtype=np.uint64)
+			for column in range(bytes_per_band):
+				keys = (keys << np.uint64(8)) | band_bytes[:, column]
+			return keys
+
+		def similarity_of(a, b):
+			vectors_a = np.asarray(matrix[a], dtype=np.float32)
+			vectors_b = np.asarray(matrix[b], dtype=np.float32)
+			return np.einsum('ij,ij->i', vectors_a, vectors_b)
+
+		writer = _CandidateWriter("hyperplane", pair_batch)
+		full_keys = _row_keys(packed[:count], count, chunk_size)
+		_verify_bands(keys_of_band, bands, full_keys, similarity_of, ids, threshold, writer, max_bucket, pair_batch)
+		del packed
+
+	basic_program.log_message(f"超平面 LSH 完成，写入候选对 {writer.total} 条")
+	return writer.total
+
+
+def fetch_candidates(method, limit = 1000, min_similarity = 0.0):
+	"""按相似度从高到低读取候选对，返回 [(id_a, 词语a, id_b, 词语b, similarity), ...]"""
+	mariadb = Db_operator()
+	return mariadb.safe_db_operation(
+		"SELECT c.id_a, a.词语, c.id_b, b.词语, c.similarity FROM similar_candidate c "
+		"JOIN chn_wordlist a ON a.id = c.id_a JOIN chn_wordlist b ON b.id = c.id_b "
+		"WHERE c.method = ? AND c.similarity >= ? ORDER BY c.similarity DESC LIMIT ?",
+		params=(method, min_similarity, limit),
+		fetch=True
+	)
+
+
+if __name__ == "__main__":
+	basic_program.boot()
+	detect_definition_duplicates(float(sys.argv[1]) if len(sys.argv) > 1 else 0.8)
@@ -0,0 +1,200 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import basic_program
+
+# 索引记录：32字节 SHA-256 摘要 + 向量在 .bin 中的字节偏移 + 维度
+INDEX_DTYPE = np.dtype([('digest', 'S32'), ('offset', '<i8'), ('dim', '<i4')])
+
+
+class EmbeddingCache(object):
+	"""
+	文本向量缓存
+
+	以 (模型名称, 是否归一化, 文本哈希) 为键缓存文本向量，避免对未变化的文本重复编码。
+	内存层为LRU缓存，持久层为磁盘上的二进制向量文件和二进制索引，索引不会整体读入内存。
+
+	磁盘文件:
+		{cache_dir}/{name}.bin   按顺序追加的float32向量
+		{cache_dir}/{name}.idx   按摘要排序的索引记录（INDEX_DTYPE），以 memmap 方式二分查找
+		{cache_dir}/{name}.log   尚未合并进 .idx 的新索引记录，flush 时追加写入
+
+	.log 超过 .idx 的 1/8（至少 compact_min 条）时，flush 会把两者合并为新的有序 .idx。
+
+	注意:
+		- 持久层只允许一个进程写入，多进程任务应由父进程创建一个长期存在的缓存，
+		  并只在父进程中查询和写入
+		- 新写入的向量在调用 flush 之前不会写入索引文件
+	"""
+	def __init__(self, cache_dir, name = "embedding_cache", capacity = 100000, compact_min = 4096):
+		self.capacity = capacity
+		self.compact_min = compact_min
+		self.memory = OrderedDict()
+		os.makedirs(cache_dir, exist_ok=True)
+		self.data_path = os.path.join(cache_dir, f"{name}.bin")
+		self.index_path = os.path.join(cache_dir, f"{name}.idx")
+		self.log_path = os.path.join(cache_dir, f"{name}.log")
+		if not os.path.exists(self.data_path):
+			# 向量文件丢失时，旧索引全部失效
+			for path in (self.index_path, self.log_path):
+				if os.path.exists(path):
+					os.remove(path)
+			open(self.data_path, 'wb').close()
+		self.index = self._map_index()
+		# 未合并的记录（.log 中的和本次新增的）数量较少，放在字典中
+		self.recent = {}
+		for record in self._read_records(self.log_path):
+			self.recent[record['digest']] = (int(record['offset']), int(record['dim']))
+		self.pending = []
+
+	@staticmethod
+	def _read_records(path):
+		if not os.path.exists(path):
+			return np.zeros(0, dtype=INDEX_DTYPE)
+		size = os.path.getsize(path)
+		if size % INDEX_DTYPE.itemsize:
+			basic_program.log_message(f"{path} 末尾记录不完整，已忽略", 30)
+		count = size // INDEX_DTYPE.itemsize
+		if count == 0:
+			return np.zeros(0, dtype=INDEX_DTYPE)
+		return np.fromfile(path, dtype=INDEX_DTYPE, count=count)
+
+	def _map_index(self):
+		if not os.path.exists(self.index_path):
+			return np.zeros(0, dtype=INDEX_DTYPE)
+		count = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize
+		if count == 0:
+			return np.zeros(0, dtype=INDEX_DTYPE)
+		return np.memmap(self.index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+
+	@staticmethod
+	def make_key(model_name, normalize_embeddings, text):
+		"""生成缓存键：(模型名称, 是否归一化, 文本) 的 SHA-256 摘要"""
+		prefix = f"{model_name}|{int(bool(normalize_embeddings))}|".encode('utf-8')
+		# 以 numpy 'S32' 的形式保存，末尾的 \x00 会被去掉，这里提前统一
+		return hashlib.sha256(prefix + text.encode('utf-8')).digest().rstrip(b'\x00')
+
+	def _remember(self, key, vector):
+		self.memory[key] = vector
+		self.memory.move_to_end(key)
+		while len(self.memory) > self.capacity:
+			self.memory.popitem(last=False)
+
+	def _locate(self, keys):
+		"""在有序索引中批量二分查找，返回 key -> (offset, dim)"""
+		found = {}
+		if not keys or len(self.index) == 0:
+			return found
+		targets = np.array(keys, dtype='S32')
+		digests = self.index['digest']
+		positions = np.minimum(np.searchsorted(digests, targets), len(self.index) - 1)
+		matched = digests[positions] == targets
+		for key, position, ok in zip(keys, positions, matched):
+			if ok:
+				found[key] = (int(self.index['offset'][position]), int(self.index['dim'][position]))
+		return found
+
+	def get_many(self, texts, model_name, normalize_embeddings = True):
+		"""
+		批量查询缓存
+
+		参数:
+			texts (list): 文本列表
+			model_name (str): 模型名称
+			normalize_embeddings (bool): 是否为归一化向量
+
+		返回:
+			tuple: (hits, misses)
+				- hits (dict): 文本下标 -> 向量(numpy.ndarray，缓存内容的副本)
+				- misses (list): 未命中的文本下标
+		"""
+		hits = {}
+		misses = []
+		unresolved = {}
+		for position, text in enumerate(texts):
+			key = self.make_key(model_name, normalize_embeddings, text)
+			if key in self.memory:
+				self.memory.move_to_end(key)
+				hits[position] = self.memory[key].copy()
+			else:
+				unresolved.setdefault(key, []).append(position)
+
+		locations = {key: self.recent[key] for key in unresolved if key in self.recent}
+		locations.update(self._locate([key for key in unresolved if key not in locations]))
+
+		# 按偏移顺序读取，减少磁盘寻道
+		disk_lookups = sorted((offset, dim, key) for key, (offset, dim) in locations.items())
+		if disk_lookups:
+			with open(self.data_path, 'rb') as file:
+				for offset, dim, key in disk_lookups:
+					file.seek(offset)
+					buffer = file.read(dim * 4)
+					if len(buffer) != dim * 4:
+						continue
+					vector = np.frombuffer(buffer, dtype=np.float32).copy()
+					self._remember(key, vector)
+					for position in unresolved.pop(key):
+						hits[position] = vector.copy()
+		for positions in unresolved.values():
+			misses.extend(positions)
+		misses.sort()
+		return hits, misses
+
+	def put_many(self, texts, vectors, model_name, normalize_embeddings = True):
+		"""
+		批量写入缓存
+
+		参数:
+			texts (list): 文本列表
+			vectors (numpy.ndarray): 形状为(len(texts), embedding_dim)的向量
+			model_name (str): 模型名称
+			normalize_embeddings (bool): 是否为归一化向量
+		"""
+		vectors = np.asarray(vectors, dtype=np.float32)
+		keys = [self.make_key(model_name, normalize_embeddings, text) for text in texts]
+		known = set(self.recent) | set(self._locate([key for key in keys if key not in self.recent]))
+		with open(self.data_path, 'ab') as file:
+			for key, vector in zip(keys, vectors):
+				self._remember(key, vector.copy())
+				if key in known:
+					continue
+				data = np.ascontiguousarray(vector).tobytes()
+				file.write(data)
+				file.flush()
+				# 以写入后的实际文件位置反推偏移，不依赖打开文件时的位置（仍要求单进程写入）
+				location = (file.tell() - len(data), int(vector.shape[0]))
+				self.recent[key] = location
+				self.pending.append((key, *location))
+				known.add(key)
+
+	def flush(self):
+		"""把新增的索引记录追加到 .log，必要时合并进有序的 .idx"""
+		if not self.pending:
+			return
+		with open(self.log_path, 'ab') as file:
+			file.write(np.array(self.pending, dtype=INDEX_DTYPE).tobytes())
+		self.pending = []
+		if len(self.recent) >= max(self.compact_min, len(self.index) // 8):
+			self._compact()
+		basic_program.log_message(f"向量缓存索引已保存，共 {len(self.index) + len(self.recent)} 条", printing = False)
+
+	def _compact(self):
+		"""把 .log 合并进 .idx，重新排序后原子替换"""
+		merged = np.concatenate((np.asarray(self.index), self._read_records(self.log_path)))
+		merged = merged[np.argsort(merged['digest'], kind='stable')]
+		temp_path = self.index_path + ".tmp"
+		merged.tofile(temp_path)
+		self.index = np.zeros(0, dtype=INDEX_DTYPE)
+		os.replace(temp_path, self.index_path)
+		open(self.log_path, 'wb').close()
+		self.index = self._map_index()
+		self.recent = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.flush()
@@ -65,6 +65,36 @@ class Db_operator(object):
 				cursor.close()
 			if conn:
 				conn.close()
-	
-
 
+	def safe_db_batch_operation(self, operation, params_list):
+		"""
+		安全的批量数据库写入操作
+		
+		Args:
+			operation: SQL语句
+			params_list: SQL参数列表，每个元素对应一行
+		"""
+		if not params_list:
+			return 0
+		conn = None
+		cursor = None
+		
+		try:
+			conn = mariadb.connect(**self.config)
+			cursor = conn.cursor()
+			
+			# 在同一事务中批量执行
+			cursor.executemany(operation, params_list)
+			conn.commit()
+			return cursor.rowcount  # 返回影响的行数
+				
+		except mariadb.Error as e:
+			print(f"数据库批量写入错误: {e}")
+			if conn:
+				conn.rollback()
+			return None
+		finally:
+			if cursor:
+				cursor.close()
+			if conn:
+				conn.close()
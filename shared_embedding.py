@@ -0,0 +1,252 @@
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import basic_program
+
+
+class SharedEmbeddingMatrix(object):
+	"""
+	多进程共享的词向量矩阵与 id/词语 索引
+
+	父进程只加载一次矩阵，子进程通过 descriptor 零拷贝地挂载同一块内存，
+	因此增加进程数不会增加矩阵占用的内存。支持两种共享方式：
+		- shared_memory: 矩阵复制到 multiprocessing.shared_memory 中（create）
+		- mmap: 直接以只读方式映射磁盘上的 .npy 文件，由操作系统页缓存共享（from_npy）
+
+	词语以UTF-8字节串连续存放在共享内存中，配合偏移数组和按字节序排好的下标数组，
+	可以在不构建私有字典的情况下完成 id -> 词语 与 词语 -> id 的查询。
+
+	示例:
+		>>> shared = SharedEmbeddingMatrix.create(matrix, words)
+		>>> with multiprocessing.Pool(8, initializer=init_worker, initargs=(shared.descriptor(),)) as pool:
+		...     scores, ids = parallel_top_k(pool, shared, queries, k=10)
+		>>> shared.unlink()
+	"""
+	def __init__(self, matrix, word_bytes, offsets, order, blocks, owner):
+		self.matrix = matrix
+		self.word_bytes = word_bytes
+		self.offsets = offsets
+		self.order = order
+		self.blocks = blocks
+		self.owner = owner
+		self.npy_path = None
+
+	@staticmethod
+	def _encode_words(words):
+		encoded = [word.encode('utf-8') for word in words]
+		offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+		offsets[1:] = np.cumsum([len(item) for item in encoded])
+		order = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64)
+		return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, order
+
+	@staticmethod
+	def _to_shared(array):
+		block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+		shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+		shared[...] = array
+		return shared, block
+
+	@classmethod
+	def create(cls, matrix, words):
+		"""
+		在父进程中把矩阵和词语索引复制到共享内存
+
+		参数:
+			matrix (numpy.ndarray): 形状为(len(words), embedding_dim)的词向量矩阵
+			words (list): 词语列表，与 matrix 的行一一对应
+		"""
+		matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+		shared_matrix, matrix_block = cls._to_shared(matrix)
+		index_arrays = cls._encode_words(words)
+		shared_index = [cls._to_shared(array) for array in index_arrays]
+		blocks = [matrix_block] + [block for _, block in shared_index]
+		basic_program.log_message(f"共享词向量矩阵已创建，{matrix.shape[0]} 个词，{matrix.nbytes / 2**20:.1f} MB", printing = False)
+		return cls(shared_matrix, *(array for array, _ in shared_index), blocks, True)
+
+	@classmethod
+	def from_npy(cls, npy_path, words):
+		"""
+		以只读 mmap 方式映射磁盘上的 .npy 矩阵，词语索引放入共享内存
+
+		参数:
+			npy_path (str): numpy.save 保存的float32矩阵文件
+			words (list): 词语列表
+		"""
+		matrix = np.load(npy_path, mmap_mode='r')
+		index_arrays = cls._encode_words(words)
+		shared_index = [cls._to_shared(array) for array in index_arrays]
+		instance = cls(matrix, *(array for array, _ in shared_index), [block for _, block in shared_index], True)
+		instance.npy_path = npy_path
+		return instance
+
+	def descriptor(self):
+		"""返回可传给子进程的挂载信息（只包含名称、形状与类型，不包含数据）"""
+		arrays = [self.matrix, self.word_bytes, self.offsets, self.order]
+		names = [block.name for block in self.blocks]
+		if self.npy_path is not None:
+			# mmap 模式下矩阵不在共享内存中，子进程按路径重新映射
+			names = [None] + names
+		return {
+			"npy_path": self.npy_path,
+			"arrays": [(name, array.shape, array.dtype.str) for name, array in zip(names, arrays)],
+		}
+
+	@classmethod
+	def attach(cls, descriptor):
+		"""在子进程中按 descriptor 零拷贝挂载共享矩阵"""
+		arrays = []
+		blocks = []
+		for name, shape, dtype in descriptor["arrays"]:
+			if name is None:
+				arrays.append(np.load(descriptor["npy_path"], mmap_mode='r'))
+				continue
+			try:
+				# 子进程只挂载不负责释放，避免 resource_tracker 在子进程退出时回收
+				block = shared_memory.SharedMemory(name=name, track=False)
+			except TypeError:
+				block = shared_memory.SharedMemory(name=name)
+			array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+			array.flags.writeable = False
+			arrays.append(array)
+			blocks.append(block)
+		instance = cls(*arrays, blocks, False)
+		instance.npy_path = descriptor["npy_path"]
+		return instance
+
+	def __len__(self):
+		return self.matrix.shape[0]
+
+	def word(self, word_id):
+		"""id -> 词语"""
+		start, end = self.offsets[word_id], self.offsets[word_id + 1]
+		return self.word_bytes[start:end].tobytes().decode('utf-8')
+
+	def word_id(self, word):
+		"""词语 -> id，不存在时返回None"""
+		target = word.encode('utf-8')
+		low, high = 0, len(self.order)
+		while low < high:
+			middle = (low + high) // 2
+			word_id = self.order[middle]
+			current = self.word_bytes[self.offsets[word_id]:self.offsets[word_id + 1]].tobytes()
+			if current < target:
+				low = middle + 1
+			else:
+				high = middle
+		if low < len(self.order):
+			word_id = int(self.order[low])
+			if self.word_bytes[self.offsets[word_id]:self.offsets[word_id + 1]].tobytes() == target:
+				return word_id
+		return None
+
+	def close(self):
+		"""断开与共享内存的连接"""
+		self.matrix = self.word_bytes = self.offsets = self.order = None
+		for block in self.blocks:
+			block.close()
+
+	def unlink(self):
+		"""由父进程调用，释放共享内存"""
+		self.close()
+		if self.owner:
+			for block in self.blocks:
+				block.unlink()
+
+
+_worker_matrix = None
+
+
+def init_worker(descriptor):
+	"""进程池初始化函数：在子进程中挂载共享矩阵"""
+	global _worker_matrix
+	_worker_matrix = SharedEmbeddingMatrix.attach(descriptor)
+
+
+def top_k_range(queries, k, start, end, block_rows = 65536):
+	"""
+	在共享矩阵的 [start, end) 行范围内计算每个查询的前k个结果
+
+	参数:
+		queries (numpy.ndarray): 形状为(nq, embedding_dim)的查询向量
+		k (int): 返回结果数
+		start, end (int): 行范围
+		block_rows (int): 每次参与矩阵乘法的行数，用于限制临时内存
+
+	返回:
+		tuple: (scores, ids)，形状均为(nq, min(k, end - start))，按分数降序排列
+	"""
+	matrix = _worker_matrix.matrix
+	queries = np.asarray(queries, dtype=np.float32)
+	best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+	best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+	for block_start in range(start, end, block_rows):
+		block_end = min(block_start + block_rows, end)
+		scores = queries @ np.asarray(matrix[block_start:block_end], dtype=np.float32).T
+		ids = np.broadcast_to(np.arange(block_start, block_end), scores.shape)
+		best_scores, best_ids = merge_top_k(
+			[(best_scores, best_ids), (scores, ids)], k
+		)
+	return best_scores, best_ids
+
+
+def merge_top_k(partials, k):
+	"""
+	合并多个 (scores, ids) 局部结果，得到全局前k个
+
+	参数:
+		partials (list): [(scores, ids), ...]，各项形状为(nq, 任意)
+		k (int): 返回结果数
+	"""
+	scores = np.concatenate([item[0] for item in partials], axis=1)
+	ids = np.concatenate([item[1] for item in partials], axis=1)
+	k = min(k, scores.shape[1])
+	if k == 0:
+		return scores[:, :0], ids[:, :0]
+	top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+	top_scores = np.take_along_axis(scores, top, axis=1)
+	order = np.argsort(-top_scores, axis=1)
+	return np.take_along_axis(top_scores, order, axis=1), np.take_along_axis(np.take_along_axis(ids, top, axis=1), order, axis=1)
+
+
+def _top_k_task(arguments):
+	return top_k_range(*arguments)
+
+
+def parallel_top_k(pool, shared, queries, k = 10, chunks = None):
+	"""
+	把矩阵按行切分给进程池并行计算前k个结果并合并
+
+	参数:
+		pool (multiprocessing.Pool): 以 init_worker 和 shared.descriptor() 初始化的进程池
+		shared (SharedEmbeddingMatrix): 父进程中的共享矩阵
+		queries (numpy.ndarray): 形状为(nq, embedding_dim)或(embedding_dim,)的查询向量
+		k (int): 返回结果数
+		chunks (int): 行范围切分数，默认为CPU核心数
+
+	返回:
+		tuple: (scores, ids)，形状为(nq, k)
+	"""
+	queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+	chunks = chunks or os.cpu_count() or 1
+	bounds = np.linspace(0, len(shared), chunks + 1, dtype=np.int64)
+	tasks = [(queries, k, int(bounds[i]), int(bounds[i + 1])) for i in range(chunks) if bounds[i] < bounds[i + 1]]
+	return merge_top_k(pool.map(_top_k_task, tasks), k)
+
+
+# 测试
+if __name__ == "__main__":
+	rng = np.random.default_rng(0)
+	test_words = [f"词{i}" for i in range(20000)]
+	test_matrix = rng.standard_normal((len(test_words), 1024)).astype(np.float32)
+	test_matrix /= np.linalg.norm(test_matrix, axis=1, keepdims=True)
+	shared = SharedEmbeddingMatrix.create(test_matrix, test_words)
+	try:
+		with multiprocessing.Pool(4, initializer=init_worker, initargs=(shared.descriptor(),)) as pool:
+			scores, ids = parallel_top_k(pool, shared, test_matrix[:3], k=5)
+		print([[shared.word(i) for i in row] for row in ids])
+		print(shared.word_id("词42"))
+	finally:
+		shared.unlink()
@@ -0,0 +1,397 @@
+import json
+import time
+
+import numpy as np
+
+import basic_program
+
+
+def generate_synthetic_query_set(word_count = 5000, dimension = 1024, neighbor_query_count = 200,
+		analogy_query_count = 200, relation_count = 8, k = 10, seed = 0):
+	"""
+	生成离线评测用的合成词汇向量与标注查询集
+
+	在单位球面上随机生成词向量，并额外植入若干“关系向量”构造的词对，
+	用于在没有真实模型和数据库的情况下评测检索配置。
+
+	参数:
+		word_count (int): 词汇数量
+		dimension (int): 向量维度，默认与 bge-large-zh 相同的1024
+		neighbor_query_count (int): 近邻查询数量，期望结果为全精度暴力检索的前k个近邻
+		analogy_query_count (int): 类比查询数量（A 之于 B 犹如 C 之于 ?）
+		relation_count (int): 植入的关系种类数
+		k (int): 近邻查询的期望近邻个数
+		seed (int): 随机种子
+
+	返回:
+		tuple: (words, matrix, query_set)
+			- words (list): 词语列表
+			- matrix (numpy.ndarray): 形状为(word_count, dimension)的float32归一化矩阵
+			- query_set (list): 标注查询，格式见 load_query_set
+	"""
+	rng = np.random.default_rng(seed)
+	words = [f"词{i}" for i in range(word_count)]
+	matrix = rng.standard_normal((word_count, dimension)).astype(np.float32)
+	matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+	# 植入关系：后半部分词 = 前半部分词 + 关系向量 + 噪声
+	half = word_count // 2
+	relations = rng.standard_normal((relation_count, dimension)).astype(np.float32)
+	relations /= np.linalg.norm(relations, axis=1, keepdims=True)
+	relation_of = rng.integers(0, relation_count, size=half)
+	noise = rng.standard_normal((half, dimension)).astype(np.float32) * (0.3 / np.sqrt(dimension))
+	planted = matrix[:half] + relations[relation_of] + noise
+	matrix[half:half * 2] = planted / np.linalg.norm(planted, axis=1, keepdims=True)
+
+	query_set = []
+	neighbor_ids = rng.choice(word_count, size=min(neighbor_query_count, word_count), replace=False)
+	scores = matrix[neighbor_ids] @ matrix.T
+	scores[np.arange(len(neighbor_ids)), neighbor_ids] = -np.inf
+	for row, word_id in enumerate(neighbor_ids):
+		top = np.argpartition(-scores[row], k)[:k]
+		top = top[np.argsort(-scores[row][top])]
+		query_set.append({
+			"type": "neighbor",
+			"word": words[word_id],
+			"expected": [words[i] for i in top],
+		})
+
+	for _ in range(analogy_query_count):
+		relation = rng.integers(0, relation_count)
+		members = np.flatnonzero(relation_of == relation)
+		if len(members) < 2:
+			continue
+		a, c = rng.choice(members, size=2, replace=False)
+		query_set.append({
+			"type": "analogy",
+			"words": [words[a], words[a + half], words[c]],
+			"expected": [words[c + half]],
+		})
+
+	return words, matrix, query_set
+
+
+def load_query_set(path):
+	"""
+	读取标注查询集（JSON）
+
+	文件内容为列表，每个元素为以下两种格式之一：
+		{"type": "neighbor", "word": "苹果", "expected": ["梨", "香蕉"]}
+		{"type": "analogy", "words": ["巴黎", "法国", "东京"], "expected": ["日本"]}
+	"""
+	with open(path, 'r', encoding='utf-8') as file:
+		return json.load(file)
+
+
+def _prepare_vectors(matrix, dimension):
+	"""按配置截断维度并重新归一化"""
+	vectors = np.asarray(matrix, dtype=np.float32)
+	if dimension and dimension < vectors.shape[1]:
+		vectors = vectors[:, :dimension]
+	norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+	norms[norms == 0] = 1
+	return np.ascontiguousarray(vectors / norms)
+
+
+class _QuantizedStore(object):
+	"""按量化方式存储向量并计算内积"""
+	def __init__(self, vectors, quantization):
+		self.quantization = quantization
+		if quantization == "float32":
+			self.data = vectors
+			self.scale = None
+		elif quantization == "float16":
+			self.data = vectors.astype(np.float16)
+			self.scale = None
+		elif quantization == "int8":
+			# 每行对称量化
+			scale = np.abs(vectors).max(axis=1) / 127
+			scale[scale == 0] = 1
+			self.data = np.round(vectors / scale[:, None]).astype(np.int8)
+			self.scale = scale.astype(np.float32)
+		else:
+			raise ValueError(f"未知的量化方式: {quantization}")
+
+	@property
+	def nbytes(self):
+		return self.data.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+	def scores(self, queries, start, end):
+		"""
+		计算 queries (nq, dim) 与第 [start, end) 行存储向量的内积
+
+		只把这一段行转换为float32，临时内存与分块大小有关，而不是整个矩阵。
+		"""
+		result = queries @ self.data[start:end].astype(np.float32).T
+		if self.scale is not None:
+			result *= self.scale[start:end]
+		return result
+
+
+def _merge_top_k(best_scores, best_ids, scores, ids, k):
+	"""把一块新的 (scores, ids) 合并进每行已有的前k个结果"""
+	scores = np.concatenate((best_scores, scores), axis=1)
+	ids = np.concatenate((best_ids, ids), axis=1)
+	top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+	return np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+
+def _finish_top_k(best_scores, best_ids):
+	"""按分数降序整理每行结果，去掉被排除或不足k个时的空位"""
+	results = []
+	order = np.argsort(-best_scores, axis=1)
+	for row_scores, row_ids in zip(np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)):
+		results.append(row_ids[np.isfinite(row_scores)])
+	return results
+
+
+class FlatIndex(object):
+	"""暴力检索索引"""
+	def __init__(self, vectors, quantization = "float32"):
+		self.store = _QuantizedStore(vectors, quantization)
+		self.count = len(vectors)
+
+	@property
+	def nbytes(self):
+		return self.store.nbytes
+
+	def search(self, queries, k, excludes, batch_size = 256, block_rows = 16384):
+		results = []
+		for batch_start in range(0, len(queries), batch_size):
+			batch = queries[batch_start:batch_start + batch_size]
+			batch_excludes = excludes[batch_start:batch_start + batch_size]
+			best_scores = np.full((len(batch), k), -np.inf, dtype=np.float32)
+			best_ids = np.full((len(batch), k), -1, dtype=np.int64)
+			for start in range(0, self.count, block_rows):
+				end = min(start + block_rows, self.count)
+				scores = self.store.scores(batch, start, end)
+				for row, exclude in enumerate(batch_excludes):
+					for word_id in exclude:
+						if start <= word_id < end:
+							scores[row, word_id - start] = -np.inf
+				ids = np.broadcast_to(np.arange(start, end), scores.shape)
+				best_scores, best_ids = _merge_top_k(best_scores, best_ids, scores, ids, k)
+			results.extend(_finish_top_k(best_scores, best_ids))
+		return results
+
+
+class IvfIndex(object):
+	"""
+	倒排文件索引（IVF）
+
+	用简单的k-means把向量划分到 nlist 个簇，检索时只扫描与查询最接近的 nprobe 个簇。
+	向量按簇连续存放，一批查询中探测到同一个簇的查询共用一次矩阵乘法。
+	"""
+	def __init__(self, vectors, quantization = "float32", nlist = 64, nprobe = 8, iterations = 10, seed = 0):
+		rng = np.random.default_rng(seed)
+		nlist = min(nlist, len(vectors))
+		self.nprobe = min(nprobe, nlist)
+		self.centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+		for _ in range(iterations):
+			assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+			for c in range(nlist):
+				members = vectors[assignment == c]
+				if len(members):
+					centroid = members.sum(axis=0)
+					self.centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+		assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+		# 按簇重新排列向量：第c个簇占据 [offsets[c], offsets[c + 1]) 行
+		self.ids = np.argsort(assignment, kind='stable')
+		self.offsets = np.searchsorted(assignment[self.ids], np.arange(nlist + 1))
+		self.position = np.empty(len(vectors), dtype=np.int64)
+		self.position[self.ids] = np.arange(len(vectors))
+		self.store = _QuantizedStore(vectors[self.ids], quantization)
+
+	@property
+	def nbytes(self):
+		return self.store.nbytes + self.centroids.nbytes + self.ids.nbytes + self.offsets.nbytes + self.position.nbytes
+
+	def search(self, queries, k, excludes, batch_size = 256):
+		results = []
+		for batch_start in range(0, len(queries), batch_size):
+			batch = queries[batch_start:batch_start + batch_size]
+			batch_excludes = excludes[batch_start:batch_start + batch_size]
+			probes = np.argpartition(-(batch @ self.centroids.T), self.nprobe - 1, axis=1)[:, :self.nprobe]
+			best_scores = np.full((len(batch), k), -np.inf, dtype=np.float32)
+			best_ids = np.full((len(batch), k), -1, dtype=np.int64)
+			for c in np.unique(probes):
+				start, end = self.offsets[c], self.offsets[c + 1]
+				if start == end:
+					continue
+				rows = np.flatnonzero((probes == c).any(axis=1))
+				scores = self.store.scores(batch[rows], start, end)
+				for local_row, row in enumerate(rows):
+					for word_id in batch_excludes[row]:
+						position = self.position[word_id]
+						if start <= position < end:
+							scores[local_row, position - start] = -np.inf
+				ids = np.broadcast_to(self.ids[start:end], scores.shape)
+				best_scores[rows], best_ids[rows] = _merge_top_k(best_scores[rows], best_ids[rows], scores, ids, k)
+			results.extend(_finish_top_k(best_scores, best_ids))
+		return results
+
+
+def _build_index(vectors, config):
+	index_type = config.get("index", "flat")
+	quantization = config.get("quantization", "float32")
+	if index_type == "flat":
+		return FlatIndex(vectors, quantization)
+	if index_type == "ivf":
+		return IvfIndex(vectors, quantization, config.get("nlist", 64), config.get("nprobe", 8))
+	raise ValueError(f"未知的索引类型: {index_type}")
+
+
+def _build_queries(vectors, word_to_id, query_set):
+	"""将标注查询转换为查询向量、排除集合与期望结果，跳过含未登录词的查询"""
+	queries, excludes, expected = [], [], []
+	for query in query_set:
+		if query["type"] == "neighbor":
+			ids = [word_to_id.get(query["word"])]
+			if ids[0] is None:
+				continue
+			vector = vectors[ids[0]]
+		elif query["type"] == "analogy":
+			ids = [word_to_id.get(word) for word in query["words"]]
+			if None in ids:
+				continue
+			a, b, c = (vectors[i] for i in ids)
+			vector = b - a + c
+			vector = vector / max(np.linalg.norm(vector), 1e-12)
+		else:
+			continue
+		queries.append(vector)
+		excludes.append(set(ids))
+		expected.append([word_to_id[word] for word in query["expected"] if word in word_to_id])
+	return np.asarray(queries, dtype=np.float32), excludes, expected
+
+
+def evaluate_config(words, matrix, query_set, config, k = 10):
+	"""
+	评测单个检索配置
+
+	参数:
+		words (list): 词语列表，与 matrix 的行一一对应
+		matrix (numpy.ndarray): 词向量矩阵（由 config["model"] 对应的模型生成）
+		query_set (list): 标注查询集
+		config (dict): 检索配置，可包含以下字段
+			- name: 配置名称
+			- model: 模型名称（仅用于记录）
+			- index: "flat" 或 "ivf"
+			- nlist / nprobe: IVF 参数
+			- quantization: "float32"、"float16" 或 "int8"
+			- dimension: 截断后的维度，None 表示不截断
+		k (int): 计算 recall@k 和 MRR 时的截断位置
+
+	返回:
+		dict: 包含 recall@k、mrr、qps、build_seconds、memory_bytes 等指标
+	"""
+	word_to_id = {word: i for i, word in enumerate(words)}
+	vectors = _prepare_vectors(matrix, config.get("dimension"))
+	queries, excludes, expected = _build_queries(vectors, word_to_id, query_set)
+
+	start = time.perf_counter()
+	index = _build_index(vectors, config)
+	build_seconds = time.perf_counter() - start
+
+	start = time.perf_counter()
+	results = index.search(queries, k, excludes) if len(queries) else []
+	search_seconds = time.perf_counter() - start
+
+	recall_total = 0.0
+	reciprocal_rank_total = 0.0
+	for found, truth in zip(results, expected):
+		if not truth:
+			continue
+		truth = set(truth)
+		found = list(found)
+		recall_total += len(truth.intersection(found)) / min(k, len(truth))
+		for rank, word_id in enumerate(found, 1):
+			if word_id in truth:
+				reciprocal_rank_total += 1 / rank
+				break
+	query_count = len(results)
+
+	return {
+		"name": config.get("name", json.dumps(config, ensure_ascii=False)),
+		"config": config,
+		"queries": query_count,
+		f"recall@{k}": recall_total / query_count if query_count else 0.0,
+		"mrr": reciprocal_rank_total / query_count if query_count else 0.0,
+		"qps": query_count / search_seconds if search_seconds > 0 else 0.0,
+		"build_seconds": build_seconds,
+		"memory_bytes": int(index.nbytes),
+	}
+
+
+def sweep_configs(words, matrices, query_set, configs, k = 10):
+	"""
+	对一组检索配置逐个评测
+
+	参数:
+		words (list): 词语列表
+		matrices (dict or numpy.ndarray): 模型名称 -> 词向量矩阵；只有一个模型时可直接传矩阵
+		query_set (list): 标注查询集
+		configs (list): 检索配置列表，见 evaluate_config
+		k (int): 评测截断位置
+
+	返回:
+		list: 每个配置的评测结果
+	"""
+	results = []
+	for config in configs:
+		matrix = matrices[config["model"]] if isinstance(matrices, dict) else matrices
+		result = evaluate_config(words, matrix, query_set, config, k)
+		basic_program.log_message(f"配置 {result['name']} 评测完成", printing = False)
+		results.append(result)
+	return results
+
+
+def format_results_table(results, k = 10):
+	"""将评测结果格式化为 Markdown 表格"""
+	lines = [
+		f"| 配置 | recall@{k} | MRR | QPS | 构建耗时(s) | 内存(MB) |",
+		"| ---- | ---- | ---- | ---- | ---- | ---- |",
+	]
+	for result in results:
+		lines.append(
+			f"| {result['name']} | {result[f'recall@{k}']:.4f} | {result['mrr']:.4f} | "
+			f"{result['qps']:.1f} | {result['build_seconds']:.3f} | {result['memory_bytes'] / 2**20:.2f} |"
+		)
+	return "\n".join(lines)
+
+
+def save_results(results, path):
+	"""将评测结果写入 JSON 文件"""
+	with open(path, 'w', encoding='utf-8') as file:
+		json.dump(results, file, ensure_ascii=False, indent=4)
+
+
+def select_fastest(results, recall_target, k = 10):
+	"""
+	选出满足召回率目标的最快配置
+
+	返回:
+		dict or None: QPS 最高且 recall@k 不低于 recall_target 的结果；没有满足条件的配置时返回None
+	"""
+	qualified = [result for result in results if result[f"recall@{k}"] >= recall_target]
+	if not qualified:
+		return None
+	return max(qualified, key=lambda result: result["qps"])
+
+
+# 测试
+if __name__ == "__main__":
+	words, matrix, query_set = generate_synthetic_query_set(word_count=5000, dimension=1024)
+	configs = [
+		{"name": "flat-f32", "index": "flat", "quantization": "float32"},
+		{"name": "flat-f16", "index": "flat", "quantization": "float16"},
+		{"name": "flat-int8", "index": "flat", "quantization": "int8"},
+		{"name": "flat-f32-d256", "index": "flat", "quantization": "float32", "dimension": 256},
+		{"name": "ivf64-p4-int8", "index": "ivf", "nlist": 64, "nprobe": 4, "quantization": "int8"},
+		{"name": "ivf64-p16-f32", "index": "ivf", "nlist": 64, "nprobe": 16, "quantization": "float32"},
+	]
+	results = sweep_configs(words, matrix, query_set, configs)
+	print(format_results_table(results))
+	save_results(results, "vector_evaluation_result.json")
+	best = select_fastest(results, 0.9)
+	print(f"满足 recall@10 >= 0.9 的最快配置: {best['name'] if best else '无'}")